@@ -2,18 +2,26 @@ import tkinter as tk
 from tkinter import scrolledtext, messagebox, simpledialog
 import os
 import json
+import mmap
+import re
+import shutil
 import threading
 import queue
+import asyncio
+import sys
+from collections import deque
 from pathlib import Path
-from openai import OpenAI, APIError, RateLimitError
+from typing import Optional
 from dotenv import load_dotenv
 
 # --- Configuration ---
 # Load environment variables (optional, if using a .env file)
-load_dotenv()
+# Skip parsing .env when the key is already exported
+if not os.environ.get("OPENAI_API_KEY"):
+    load_dotenv()
 
 # Check for API key
-API_KEY = os.getenv("OPENAI_API_KEY")
+API_KEY = os.environ.get("OPENAI_API_KEY")
 if not API_KEY:
     print("Error: OPENAI_API_KEY environment variable not set.")
     # Optionally use simpledialog to ask for the key if not set
@@ -22,20 +30,34 @@ if not API_KEY:
         messagebox.showerror("API Key Error", "OpenAI API Key is required to run the application.")
         exit() # Exit if still no key
 
-# Initialize OpenAI client
-try:
-    client = OpenAI(api_key=API_KEY)
-    # Test connection (optional, but good practice)
-    # client.models.list() # This call can verify the key early
-except APIError as e:
-     messagebox.showerror("OpenAI API Error", f"Failed to initialize OpenAI client: {e}")
-     exit()
-except Exception as e:
-    messagebox.showerror("Error", f"An unexpected error occurred during OpenAI client initialization: {e}")
-    exit()
+# Project root used by the tools' security checks (resolved once at startup)
+PROJECT_ROOT_STR = str(Path.cwd().resolve())
+# Working directory as shown in messages and error text
+PROJECT_DIR = str(Path.cwd())
 
 # --- Tool Functions ---
 
+def _safe_abs(path_str: str) -> Optional[str]:
+    """
+    Helper to make a path absolute and check that it stays inside the project directory.
+    Returns the absolute path string, or None if it points outside the project.
+    This is pure string work (no filesystem access), so symlinks are not followed:
+    a symlink inside the project that points elsewhere is not caught here.
+    The write paths (edit_file, create_new_file) add an os.path.realpath +
+    _inside_project check before writing; read_file and list_files rely on this
+    check alone and will follow such a symlink out of the project.
+    """
+    abs_path = os.path.abspath(path_str)
+    return abs_path if _inside_project(abs_path) else None
+
+def _inside_project(abs_path: str) -> bool:
+    """Helper to check that an absolute path lies within PROJECT_ROOT_STR (string comparison only)."""
+    try:
+        common = os.path.commonpath([abs_path, PROJECT_ROOT_STR])
+    except ValueError: # e.g. different drives on Windows
+        return False
+    return os.path.normcase(common) == os.path.normcase(PROJECT_ROOT_STR)
+
 def read_file(path: str) -> str:
     """
     Read the contents of a given relative file path.
@@ -44,16 +66,18 @@ def read_file(path: str) -> str:
     Returns the file content as a string or an error message.
     """
     try:
-        file_path = Path(path).resolve()
         # Basic security check: prevent reading files outside the current working dir tree
         # You might want stricter checks depending on your use case.
-        if not file_path.is_relative_to(Path.cwd().resolve()):
-             return f"Error: Access denied. Can only read files within the current project directory: {Path.cwd()}"
-        if not file_path.is_file():
+        file_path = _safe_abs(path)
+        if file_path is None:
+            return f"Error: Access denied. Can only read files within the current project directory: {PROJECT_DIR}"
+        if not os.path.isfile(file_path):
             return f"Error: Path '{path}' is not a file or does not exist."
-        content = file_path.read_text(encoding='utf-8')
         # Truncate long files to avoid excessive token usage / overly long responses
         max_len = 10000 # Adjust as needed
+        # Only read (and decode) what can be kept; one extra char tells us if it was truncated
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read(max_len + 1)
         if len(content) > max_len:
              return content[:max_len] + "\n\n[... File truncated due to length ...]"
         return content
@@ -72,30 +96,32 @@ def list_files(path: str = ".") -> str:
     or an error message. Directories are marked with a trailing '/'.
     """
     try:
-        base_path = Path(path).resolve()
         # Basic security check
-        if not base_path.is_relative_to(Path.cwd().resolve()):
-             return f"Error: Access denied. Can only list files within the current project directory: {Path.cwd()}"
-        if not base_path.is_dir():
+        base_path = _safe_abs(path)
+        if base_path is None:
+            return f"Error: Access denied. Can only list files within the current project directory: {PROJECT_DIR}"
+        if not os.path.isdir(base_path):
             return f"Error: Path '{path}' is not a directory or does not exist."
 
         items = []
         max_items = 200 # Limit the number of items listed
         count = 0
-        for item in base_path.iterdir():
-            if count >= max_items:
-                 items.append("[... Directory listing truncated due to size ...]")
-                 break
-            # Construct relative path from the *original* potentially relative input path
-            # This avoids exposing absolute paths in the listing
-            rel_path = Path(path) / item.name
-            if item.is_dir():
-                items.append(f"{rel_path}/")
-            else:
-                items.append(str(rel_path))
-            count += 1
-
-        return json.dumps(items) # Return as a JSON string for the LLM
+        # Construct relative paths from the *original* potentially relative input path
+        # This avoids exposing absolute paths in the listing
+        prefix = os.path.normpath(path)
+        prefix = "" if prefix == "." else prefix.rstrip("/\\") + "/"
+        # os.scandir exposes each entry's type from the directory read itself,
+        # so is_dir() doesn't need an extra stat per child
+        with os.scandir(base_path) as it:
+            for entry in it:
+                if count >= max_items:
+                     items.append("[... Directory listing truncated due to size ...]")
+                     break
+                items.append(prefix + entry.name + ('/' if entry.is_dir(follow_symlinks=False) else ''))
+                count += 1
+
+        # Return as a compact JSON string for the LLM
+        return json.dumps(items, ensure_ascii=False, separators=(',', ':'))
     except FileNotFoundError:
         return f"Error: Directory not found at path '{path}'"
     except PermissionError:
@@ -106,20 +132,43 @@ def list_files(path: str = ".") -> str:
 def create_new_file(file_path_str: str, content: str) -> str:
     """Helper to create a new file and necessary directories."""
     try:
-        file_path = Path(file_path_str).resolve()
         # Security check
-        if not file_path.is_relative_to(Path.cwd().resolve()):
-             return f"Error: Access denied. Can only create files within the current project directory: {Path.cwd()}"
+        file_path = _safe_abs(file_path_str)
+        if file_path is None:
+            return f"Error: Access denied. Can only create files within the current project directory: {PROJECT_DIR}"
+        # Writes must not follow a symlink (in the parents or the file itself) out of the project
+        if not _inside_project(os.path.realpath(file_path)):
+            return f"Error: Access denied. Can only create files within the current project directory: {PROJECT_DIR}"
 
         # Create parent directories if they don't exist
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        file_path.write_text(content, encoding='utf-8')
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(content)
         return f"Successfully created file {file_path_str}"
     except PermissionError:
         return f"Error: Permission denied to create file or directory for '{file_path_str}'"
     except Exception as e:
         return f"Error creating file '{file_path_str}': {str(e)}"
 
+# Escape sequences the model sometimes sends literally, undone in a single pass
+_ESC_RE = re.compile(r'\\[nt"]')
+_ESC_MAP = {'\\n': '\n', '\\t': '\t', '\\"': '"'}
+
+def _unescape(text: str) -> str:
+    """Helper to turn literal \\n, \\t and \\" sequences into the characters they stand for."""
+    return _ESC_RE.sub(lambda m: _ESC_MAP[m.group(0)], text)
+
+def _file_contains(file_path: str, needle: str) -> bool:
+    """Helper to check for a substring in a file via mmap, without reading it into memory."""
+    if os.path.getsize(file_path) == 0:
+        return needle == "" # mmap can't map an empty file
+    encoded = needle.encode('utf-8')
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm.find(encoded) >= 0:
+            return True
+        # Text-mode reads normalize newlines, so also accept Windows line endings on disk
+        return b"\n" in encoded and mm.find(encoded.replace(b"\n", b"\r\n")) >= 0
+
 def edit_file(path: str, old_str: str, new_str: str) -> str:
     """
     Make edits to a text file by replacing occurrences of 'old_str' with 'new_str'.
@@ -133,49 +182,67 @@ def edit_file(path: str, old_str: str, new_str: str) -> str:
         return "Error: 'path' cannot be empty."
 
     try:
-        file_path = Path(path).resolve()
         # Security check
-        if not file_path.is_relative_to(Path.cwd().resolve()):
-             return f"Error: Access denied. Can only edit files within the current project directory: {Path.cwd()}"
+        file_path = _safe_abs(path)
+        if file_path is None:
+            return f"Error: Access denied. Can only edit files within the current project directory: {PROJECT_DIR}"
 
         # Handle file creation case
-        if not file_path.exists():
+        if not os.path.exists(file_path):
             if old_str == "":
                 return create_new_file(path, new_str)
             else:
                 return f"Error: File not found at path '{path}' and 'old_str' is not empty (cannot replace in non-existent file)."
 
         # Handle file editing case
-        if not file_path.is_file():
+        if not os.path.isfile(file_path):
             return f"Error: Path '{path}' exists but is not a file."
-
-        original_content = file_path.read_text(encoding='utf-8')
+        # Edits go to the real file, so a symlink must not lead out of the project
+        target_path = os.path.realpath(file_path)
+        if not _inside_project(target_path):
+            return f"Error: Access denied. Can only edit files within the current project directory: {PROJECT_DIR}"
 
         # The OpenAI model might send escaped newlines, etc. try to handle common cases
         # This might need refinement based on observed model behavior
-        processed_old_str = old_str.replace('\\n', '\n').replace('\\t', '\t').replace('\\"', '"')
-        processed_new_str = new_str.replace('\\n', '\n').replace('\\t', '\t').replace('\\"', '"')
+        processed_old_str = _unescape(old_str)
+        processed_new_str = _unescape(new_str)
+
+        # An empty old_str would insert new_str between every character of the file
+        if processed_old_str == "":
+            return f"Error: 'old_str' is empty but file '{path}' already exists; refusing to insert new_str between every character."
 
-        # Check if old_str exists before replacing
-        if processed_old_str != "" and processed_old_str not in original_content:
+        # Check if old_str exists before replacing (probed on disk, so a miss never loads the file)
+        if not _file_contains(file_path, processed_old_str):
              # Offer suggestions if minor differences exist (e.g., whitespace)
-             if old_str.strip() in original_content:
+             if _file_contains(file_path, old_str.strip()):
                  return f"Error: 'old_str' ('{old_str}') not found exactly in file. Did you mean '{old_str.strip()}' (ignoring leading/trailing whitespace)?"
              # Add more fuzzy matching or suggestions if needed
              return f"Error: 'old_str' ('{old_str}') not found exactly in file '{path}'. Replacement aborted."
 
+        with open(file_path, 'r', encoding='utf-8') as f:
+            original_content = f.read()
 
         new_content = original_content.replace(processed_old_str, processed_new_str)
 
         # Prevent accidental no-op writes if replacement didn't change anything
-        # (This check is only meaningful if old_str was supposed to be found)
-        if processed_old_str != "" and new_content == original_content:
+        if new_content == original_content:
             # This case should ideally be caught by the "not found" check above,
             # but serves as a fallback.
             return f"Warning: Replacing '{old_str}' with '{new_str}' resulted in no changes to the file '{path}'. Check if 'old_str' exists."
 
 
-        file_path.write_text(new_content, encoding='utf-8')
+        # Write to a temp file next to the target and swap it in atomically, so a crash
+        # never leaves a half-written file behind. Swap into the real file, so editing
+        # through a symlink updates its target instead of replacing the link.
+        tmp_path = f"{target_path}.{threading.get_ident()}.tmp" # Unique per worker thread
+        try:
+            with open(tmp_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+                f.write(new_content)
+            shutil.copymode(target_path, tmp_path) # Keep the original permissions
+            os.replace(tmp_path, target_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
         return "OK" # Simple confirmation
 
     except FileNotFoundError:
@@ -195,7 +262,71 @@ available_tools = {
     "edit_file": edit_file,
 }
 
+def _dispatch(tool_call: dict) -> tuple:
+    """
+    Run a single tool call from the model.
+    Returns a (function_response, is_error) tuple; errors are returned, never raised.
+    """
+    function_name = tool_call["function"]["name"]
+    function_args_json = tool_call["function"]["arguments"]
+
+    # Find the function
+    function_to_call = available_tools.get(function_name)
+    if not function_to_call:
+        return f"Error: Tool '{function_name}' not found.", True
+
+    try:
+        # Parse arguments (handle potential JSON errors)
+        function_args = json.loads(function_args_json)
+        # Call the actual tool function
+        return function_to_call(**function_args), False
+    except json.JSONDecodeError:
+        return f"Error: Invalid JSON arguments received for {function_name}: {function_args_json}", True
+    except TypeError as e:
+        # Handles wrong arguments passed to the function
+        return f"Error: Invalid arguments for tool {function_name}: {e}. Args received: {function_args_json}", True
+    except Exception as e:
+        return f"Error executing tool {function_name}: {str(e)}", True
+
+def _lane_key(tool_call: dict, index: int) -> tuple:
+    """
+    Group key for running a turn's tool calls: calls that read or edit the same file
+    share a key and run in order; every other call gets a key of its own.
+    """
+    if tool_call["function"]["name"] in ("read_file", "edit_file"):
+        try:
+            path = json.loads(tool_call["function"]["arguments"]).get("path")
+        except (json.JSONDecodeError, AttributeError):
+            path = None
+        if isinstance(path, str) and path:
+            # realpath, so edits through a symlink share a lane with its target
+            return ("file", os.path.realpath(path))
+    return ("call", index)
+
+def _dispatch_lane(tool_calls: list) -> list:
+    """Run tool calls one after another; returns their _dispatch results in order."""
+    return [_dispatch(tool_call) for tool_call in tool_calls]
+
+async def _dispatch_all(tool_calls: list) -> list:
+    """
+    Run a turn's tool calls and return their _dispatch results in call order.
+    Independent calls run concurrently in worker threads, while calls on the same
+    file run sequentially, so one edit_file never overwrites another's changes.
+    """
+    lanes = {}
+    for index, tool_call in enumerate(tool_calls):
+        lanes.setdefault(_lane_key(tool_call, index), []).append(index)
+    lane_results = await asyncio.gather(*[
+        asyncio.to_thread(_dispatch_lane, [tool_calls[i] for i in indexes]) for indexes in lanes.values()
+    ])
+    results = [None] * len(tool_calls)
+    for indexes, lane_result in zip(lanes.values(), lane_results):
+        for i, result in zip(indexes, lane_result):
+            results[i] = result
+    return results
+
 # Define tools in OpenAI's required format
+# (the SDK encodes this on every request; it has no way to take a pre-serialized schema)
 tools_openai_format = [
     {
         "type": "function",
@@ -259,6 +390,32 @@ tools_openai_format = [
 ]
 
 
+# --- Conversation History Limits ---
+# Only the most recent part of the conversation is sent with each API call
+HISTORY_MAX_MESSAGES = 20 # Most recent messages to send
+HISTORY_CHAR_BUDGET = 40_000 # Rough cap on the characters sent per call
+TOOL_RESULT_KEEP_CHARS = 500 # Over budget, tool results from earlier turns are cut to this length
+# Bounds on what is kept in memory for the whole session
+HISTORY_MAX_STORED = 200 # Most messages kept in conversation_history
+HISTORY_BYTE_BUDGET = 1_000_000 # Rough cap on the characters kept in conversation_history
+INTERN_MAX_CHARS = 64 # Short tool results ("OK", common errors) are interned
+# Trailing whitespace and runs of blank lines, squeezed out of compacted tool results
+_WS_RUN_RE = re.compile(r'[ \t]+(?=\n)|\n{3,}')
+
+def _message_chars(message: dict) -> int:
+    """Approximate size of a history message: its text plus any tool call arguments."""
+    size = len(message.get("content") or "")
+    for tool_call in message.get("tool_calls") or ():
+        size += len(tool_call["function"]["arguments"])
+    return size
+
+def _compact_tool_result(content: str) -> str:
+    """Shortened form of an earlier tool result, sent when the history is over budget."""
+    content = _WS_RUN_RE.sub(lambda m: "\n\n" if m.group(0).startswith("\n") else "", content)
+    compacted = content[:TOOL_RESULT_KEEP_CHARS] + " [... result truncated ...]"
+    return compacted if len(compacted) < len(content) else content
+
+
 # --- Agent Class ---
 class CodeAgentApp:
     def __init__(self, root):
@@ -275,14 +432,31 @@ class CodeAgentApp:
         y = (screen_height/2) - (window_height/2)
         root.geometry(f'{window_width}x{window_height}+{int(x)}+{int(y)}')
 
-        self.conversation_history = [] # Stores messages for OpenAI API
+        self.conversation_history = deque() # Stores messages for OpenAI API (bounded by _append_history)
+        self._history_bytes = 0 # Running size of conversation_history (see _message_chars)
+        self._last_user_message = None # Start of the current turn; never evicted
         self.message_queue = queue.Queue() # For thread-safe GUI updates
+        self.root.bind("<<QueueMessage>>", self._drain_queue) # Fired whenever a message is queued
+        self._pending_agent_buf = [] # Streamed text waiting to be inserted
+        self._flush_scheduled = False # Whether a _flush_agent_buf call is pending
+
+        # Background event loop that runs the API calls and tool execution
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
 
         # --- GUI Elements ---
         # Conversation display area
         self.text_area = scrolledtext.ScrolledText(root, wrap=tk.WORD, state='disabled', font=("Arial", 10))
         self.text_area.pack(padx=10, pady=10, expand=True, fill='both')
 
+        # Configure tags for colors once (similar to the Go example)
+        self.text_area.tag_config("You", foreground="#0000FF") # Blue
+        self.text_area.tag_config("Agent", foreground="#B8860B") # DarkGoldenrod (like Claude's yellow)
+        self.text_area.tag_config("Tool", foreground="#008000", font=("Arial", 9, "italic")) # Green, italic
+        self.text_area.tag_config("ToolResult", foreground="#555555", font=("Arial", 9)) # Gray
+        self.text_area.tag_config("System", foreground="#666666", font=("Arial", 9, "italic")) # Dark Gray
+        self.text_area.tag_config("Error", foreground="#FF0000", font=("Arial", 10, "bold")) # Red, bold
+
         # Input frame
         input_frame = tk.Frame(root)
         input_frame.pack(fill='x', padx=10, pady=(0, 10))
@@ -293,183 +467,336 @@ class CodeAgentApp:
         self.input_entry.bind("<Return>", self.send_message_event) # Bind Enter key
 
         # Send button
-        self.send_button = tk.Button(input_frame, text="Send", command=self.send_message_event, width=10)
+        self.send_button = tk.Button(input_frame, text="Send", command=self.send_message_event, width=10, state='disabled')
         self.send_button.pack(side=tk.LEFT, padx=(5, 0))
 
         # --- Initial Setup ---
         self.add_message_to_display("System", "Chat with the Agent (using OpenAI). Use tools like read_file, list_files, edit_file.")
-        self.add_message_to_display("System", f"Working directory: {Path.cwd()}")
+        self.add_message_to_display("System", f"Working directory: {PROJECT_DIR}")
         # Add initial system prompt if desired (can help guide the model)
-        # self.conversation_history.append({"role": "system", "content": "You are a helpful coding assistant agent..."})
+        # self._append_history({"role": "system", "content": "You are a helpful coding assistant agent..."})
+
+        # Show anything queued before the event loop started
+        self.root.after_idle(self._drain_queue)
+
+        # The OpenAI client is created once the window is up (importing openai is slow)
+        self.client = None
+        self.add_message_to_display("System", "Connecting to OpenAI...", tag="System")
+        # Import and create it on the background loop thread, so the Tk thread keeps drawing
+        self.loop.call_soon_threadsafe(self._init_openai)
+
+    def _init_openai(self):
+        """Imports the OpenAI SDK and creates the client (runs on the background loop thread)."""
+        try:
+            from openai import AsyncOpenAI, APIError
+        except ImportError as e:
+            self.root.after(0, self._openai_failed, "Error", f"The openai package is required: {e}")
+            return
+
+        try:
+            # Async client: one pooled keep-alive connection is reused across all calls
+            client = AsyncOpenAI(api_key=API_KEY)
+            # Test connection (optional, but good practice)
+            # client.models.list() # This call can verify the key early
+        except APIError as e:
+            self.root.after(0, self._openai_failed, "OpenAI API Error", f"Failed to initialize OpenAI client: {e}")
+            return
+        except Exception as e:
+            self.root.after(0, self._openai_failed, "Error", f"An unexpected error occurred during OpenAI client initialization: {e}")
+            return
+
+        # Hand the client to the Tk thread, which enables sending
+        self.root.after(0, self._openai_ready, client)
+
+    def _openai_ready(self, client):
+        """Stores the OpenAI client and enables sending (runs on the Tk thread)."""
+        self.client = client
+        self.add_message_to_display("System", "Connected. Ready for your request.", tag="System")
+        self.send_button.config(state='normal')
 
-        # Start checking the queue for messages from the worker thread
-        self.root.after(100, self.process_message_queue)
+    def _openai_failed(self, title, message):
+        """Reports a failed OpenAI setup and closes the app (runs on the Tk thread)."""
+        messagebox.showerror(title, message)
+        self.root.destroy()
 
-    def process_message_queue(self):
-        """Processes messages from the worker thread to update the GUI safely."""
+    def _drain_queue(self, event=None):
+        """Processes queued messages from the worker thread to update the GUI safely."""
         try:
             while True:
-                role, content, tag = self.message_queue.get_nowait()
-                self._add_message_to_display_internal(role, content, tag)
+                role, content, tag, append = self.message_queue.get_nowait()
+                if append and not tag:
+                    # Streamed text: buffer it and insert in batches, at most once per frame
+                    self._pending_agent_buf.append(content)
+                    if not self._flush_scheduled:
+                        self._flush_scheduled = True
+                        self.root.after(16, self._flush_agent_buf)
+                else:
+                    self._flush_agent_buf() # Keep buffered text ahead of this message
+                    self._add_message_to_display_internal(role, content, tag, append)
         except queue.Empty:
             pass
-        finally:
-            # Reschedule itself
-            self.root.after(100, self.process_message_queue)
 
-    def add_message_to_display(self, role, content, tag=None):
-        """Adds a message to the queue for thread-safe GUI update."""
+    def _flush_agent_buf(self):
+        """Inserts any buffered streamed text with a single insert and scroll."""
+        self._flush_scheduled = False
+        if not self._pending_agent_buf:
+            return
+        joined = "".join(self._pending_agent_buf)
+        self._pending_agent_buf.clear()
+        self._add_message_to_display_internal("Agent", joined, append=True)
+
+    def add_message_to_display(self, role, content, tag=None, append=False):
+        """Adds a message to the queue for thread-safe GUI update.
+        With append=True the content is written as-is (no role prefix, no newline),
+        which is how streamed fragments are continued on the current line."""
         # Put the message into the queue instead of directly updating the GUI
-        self.message_queue.put((role, content, tag))
+        self.message_queue.put((role, content, tag, append))
+        # Wake the Tk event loop to drain the queue (safe to call from worker threads)
+        self.root.event_generate("<<QueueMessage>>", when="tail")
 
-    def _add_message_to_display_internal(self, role, content, tag=None):
-        """Internal method to update the text area (called by process_message_queue)."""
+    def _add_message_to_display_internal(self, role, content, tag=None, append=False):
+        """Internal method to update the text area (called by _drain_queue)."""
         self.text_area.config(state='normal')
-        if tag:
+        if append:
+            self.text_area.insert(tk.END, content, (tag,) if tag else ())
+        elif tag:
             self.text_area.insert(tk.END, f"{role}: ", (role, tag))
             self.text_area.insert(tk.END, f"{content}\n", (tag,))
         else:
             self.text_area.insert(tk.END, f"{role}: ", (role,))
             self.text_area.insert(tk.END, f"{content}\n")
 
-        # Configure tags for colors (similar to the Go example)
-        self.text_area.tag_config("You", foreground="#0000FF") # Blue
-        self.text_area.tag_config("Agent", foreground="#B8860B") # DarkGoldenrod (like Claude's yellow)
-        self.text_area.tag_config("Tool", foreground="#008000", font=("Arial", 9, "italic")) # Green, italic
-        self.text_area.tag_config("ToolResult", foreground="#555555", font=("Arial", 9)) # Gray
-        self.text_area.tag_config("System", foreground="#666666", font=("Arial", 9, "italic")) # Dark Gray
-        self.text_area.tag_config("Error", foreground="#FF0000", font=("Arial", 10, "bold")) # Red, bold
-
         self.text_area.see(tk.END) # Scroll to the bottom
         self.text_area.config(state='disabled')
 
+    def _append_history(self, message):
+        """
+        Appends a message to conversation_history, keeping it within HISTORY_MAX_STORED
+        messages and HISTORY_BYTE_BUDGET characters by evicting the oldest messages.
+        """
+        if message["role"] == "tool" and len(message["content"]) <= INTERN_MAX_CHARS:
+            message["content"] = sys.intern(message["content"])
+        elif message["role"] == "user":
+            self._last_user_message = message
+
+        history = self.conversation_history
+        self._history_bytes += _message_chars(message)
+        history.append(message)
+        while len(history) > 1 and (len(history) > HISTORY_MAX_STORED or self._history_bytes > HISTORY_BYTE_BUDGET):
+            if history[0] is self._last_user_message:
+                break # Keep the current turn intact, even if it is over budget
+            self._evict_oldest()
+            # Tool results go together with the assistant message that requested them
+            while history and history[0]["role"] == "tool":
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        """Drops the oldest message from conversation_history."""
+        evicted = self.conversation_history.popleft()
+        self._history_bytes -= _message_chars(evicted)
+
+    def _trim_history(self):
+        """
+        Builds the message list for the next API call.
+        Only the most recent messages within HISTORY_MAX_MESSAGES / HISTORY_CHAR_BUDGET
+        are sent, preceded by a short summary of what was left out. While over budget,
+        tool results from earlier turns are first cut to TOOL_RESULT_KEEP_CHARS, then
+        the oldest messages are dropped. The current turn is always sent in full, and
+        the stored history is never modified.
+        """
+        history = list(self.conversation_history)
+        # Leading system prompt(s) are always sent
+        n_system = 0
+        while n_system < len(history) and history[n_system]["role"] == "system":
+            n_system += 1
+        system_messages = history[:n_system]
+        messages = history[n_system:]
+
+        # Never cut into the current turn (from the latest user message on)
+        limit = len(messages)
+        while limit > 0 and messages[limit - 1]["role"] != "user":
+            limit -= 1
+        limit = max(limit - 1, 0)
+
+        start = min(max(len(messages) - HISTORY_MAX_MESSAGES, 0), limit)
+        # Never start on a tool result whose assistant tool_calls message was left out
+        while start < limit and messages[start]["role"] == "tool":
+            start += 1
+        kept = messages[start:]
+        limit -= start
+        total = sum(_message_chars(m) for m in kept)
+
+        # Over budget: shorten earlier turns' tool results, oldest first (on copies)
+        for i in range(limit):
+            if total <= HISTORY_CHAR_BUDGET:
+                break
+            message = kept[i]
+            if message["role"] == "tool":
+                compacted = _compact_tool_result(message["content"])
+                if len(compacted) < len(message["content"]):
+                    total -= len(message["content"]) - len(compacted)
+                    kept[i] = {**message, "content": compacted}
+
+        # Still over budget: drop the oldest messages of earlier turns
+        drop = 0
+        while drop < limit and (total > HISTORY_CHAR_BUDGET or kept[drop]["role"] == "tool"):
+            total -= _message_chars(kept[drop])
+            drop += 1
+        start += drop
+        kept = kept[drop:]
+
+        if start == 0:
+            return system_messages + kept
+
+        dropped = messages[:start]
+        summary = f"Earlier context summary: {len(dropped)} earlier messages were omitted to save space."
+        user_requests = [m["content"][:200] for m in dropped if m["role"] == "user"]
+        if user_requests:
+            summary += " Earlier user requests: " + "; ".join(user_requests[-5:])
+        return system_messages + [{"role": "system", "content": summary}] + kept
+
     def send_message_event(self, event=None):
         """Handles the send button click or Enter key press."""
+        if self.client is None:
+            return # Still connecting
         user_input = self.input_entry.get().strip()
         if not user_input:
             return # Ignore empty input
 
         self.add_message_to_display("You", user_input)
-        self.conversation_history.append({"role": "user", "content": user_input})
+        self._append_history({"role": "user", "content": user_input})
         self.input_entry.delete(0, tk.END) # Clear input field
 
         # Disable input/button while processing
         self.input_entry.config(state='disabled')
         self.send_button.config(state='disabled')
 
-        # Start API call in a separate thread to avoid blocking GUI
-        thread = threading.Thread(target=self.run_inference_thread, daemon=True)
-        thread.start()
+        # Run the API call on the background event loop to avoid blocking GUI
+        asyncio.run_coroutine_threadsafe(self._run_inference_async(), self.loop)
 
-    def run_inference_thread(self):
-        """Runs the OpenAI API call and tool execution logic in a background thread."""
+    async def _run_inference_async(self):
+        """Runs the OpenAI API call and tool execution logic on the background event loop."""
+        from openai import APIError, RateLimitError # Already loaded by _init_openai
         try:
-            response = client.chat.completions.create(
-                model="gpt-4.1-2025-04-14",
-                messages=self.conversation_history,
-                tools=tools_openai_format,
-                tool_choice="auto",  # Let the model decide when to use tools
-                max_tokens=32768 # Adjust as needed
-            )
-
-            response_message = response.choices[0].message
-            tool_calls = response_message.tool_calls # Check if the model wants to call tools
-
-            # Step 1: Append the Assistant's response (even if it includes tool calls)
-            # We store the *entire* message object including potential tool_calls
-            # This is important for the API context in the next turn.
-            self.conversation_history.append(response_message)
-
-            if tool_calls:
-                 # Step 2: Handle Tool Calls
-                 self.add_message_to_display("Agent", "Okay, I need to use some tools...") # Let user know
-
-                 # Step 3: Execute tools and gather results
-                 tool_messages_for_next_call = [] # Store tool results for the *next* API call
-                 for tool_call in tool_calls:
-                     function_name = tool_call.function.name
-                     function_args_json = tool_call.function.arguments
-                     tool_call_id = tool_call.id # Important!
-
-                     # Display the tool call in the GUI
-                     self.add_message_to_display("Tool", f"Calling: {function_name}({function_args_json})", tag="Tool")
-
-                     # Find the function
-                     function_to_call = available_tools.get(function_name)
-
-                     if function_to_call:
-                         try:
-                             # Parse arguments (handle potential JSON errors)
-                             function_args = json.loads(function_args_json)
-                             # Call the actual tool function
-                             function_response = function_to_call(**function_args)
-                         except json.JSONDecodeError:
-                             function_response = f"Error: Invalid JSON arguments received for {function_name}: {function_args_json}"
-                             self.add_message_to_display("Error", function_response, tag="Error")
-                         except TypeError as e:
-                             # Handles wrong arguments passed to the function
-                             function_response = f"Error: Invalid arguments for tool {function_name}: {e}. Args received: {function_args_json}"
-                             self.add_message_to_display("Error", function_response, tag="Error")
-                         except Exception as e:
-                             function_response = f"Error executing tool {function_name}: {str(e)}"
+            # Keep calling the model until it answers without requesting tools
+            while True:
+                stream = await self.client.chat.completions.create(
+                    model="gpt-4.1-2025-04-14",
+                    messages=self._trim_history(),
+                    tools=tools_openai_format,
+                    tool_choice="auto",  # Let the model decide when to use tools
+                    max_tokens=32768, # Adjust as needed
+                    stream=True # Push tokens to the GUI as they arrive
+                )
+
+                # Consume the stream: text deltas go straight to the display,
+                # tool call fragments are merged by index until the stream ends.
+                # The stream is read to its end so the connection goes back to the pool.
+                content_parts = []
+                tool_call_parts = {}
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta.content:
+                        if not content_parts:
+                            self.add_message_to_display("Agent", "Agent: ", tag="Agent", append=True)
+                        content_parts.append(delta.content)
+                        self.add_message_to_display("Agent", delta.content, append=True)
+                    if delta.tool_calls:
+                        for tc in delta.tool_calls:
+                            part = tool_call_parts.setdefault(tc.index, {"id": None, "name": "", "arguments": ""})
+                            if tc.id:
+                                part["id"] = tc.id
+                            if tc.function:
+                                if tc.function.name:
+                                    part["name"] += tc.function.name
+                                if tc.function.arguments:
+                                    part["arguments"] += tc.function.arguments
+                if content_parts:
+                    self.add_message_to_display("Agent", "\n", append=True) # Close the streamed line
+
+                # Rebuild the assistant message from the streamed pieces
+                tool_calls = [
+                    {
+                        "id": part["id"],
+                        "type": "function",
+                        "function": {"name": part["name"], "arguments": part["arguments"]},
+                    }
+                    for _, part in sorted(tool_call_parts.items())
+                ] or None # Check if the model wants to call tools
+                response_message = {"role": "assistant", "content": "".join(content_parts) or None}
+                if tool_calls:
+                    response_message["tool_calls"] = tool_calls
+
+                # Step 1: Append the Assistant's response (even if it includes tool calls)
+                # We store the *entire* message including potential tool_calls
+                # This is important for the API context in the next turn.
+                self._append_history(response_message)
+
+                if tool_calls:
+                     # Step 2: Handle Tool Calls
+                     self.add_message_to_display("Agent", "Okay, I need to use some tools...") # Let user know
+
+                     # Step 3: Execute tools and gather results
+                     for tool_call in tool_calls:
+                         # Display the tool call in the GUI
+                         self.add_message_to_display("Tool", f"Calling: {tool_call['function']['name']}({tool_call['function']['arguments']})", tag="Tool")
+                     # Tools are I/O-bound, so independent calls run concurrently in worker threads
+                     results = await _dispatch_all(tool_calls)
+
+                     tool_messages_for_next_call = [] # Store tool results for the *next* API call
+                     for tool_call, (function_response, is_error) in zip(tool_calls, results):
+                         function_name = tool_call["function"]["name"]
+                         tool_call_id = tool_call["id"] # Important!
+                         if is_error:
                              self.add_message_to_display("Error", function_response, tag="Error")
-                     else:
-                         function_response = f"Error: Tool '{function_name}' not found."
-                         self.add_message_to_display("Error", function_response, tag="Error")
-
-                     # Display the tool result
-                     # Limit display length for very long results (like file content)
-                     display_response = function_response
-                     max_display_len = 500
-                     if len(display_response) > max_display_len:
-                        display_response = display_response[:max_display_len] + " [... result truncated ...]"
-                     self.add_message_to_display("ToolResult", f"Result: {display_response}", tag="ToolResult")
-
-                     # Append the tool result message for the next API call
-                     tool_messages_for_next_call.append({
-                         "tool_call_id": tool_call_id,
-                         "role": "tool",
-                         "name": function_name,
-                         "content": function_response, # Send the *full* response back to the model
-                     })
-
-                 # Step 4: Append all tool results to history
-                 self.conversation_history.extend(tool_messages_for_next_call)
-
-                 # Step 5: Call the API *again* with the tool results
-                 # Use recursion or just call the method again
-                 self.run_inference_thread() # Let the model process the tool results
-
-            else:
-                # Step 2 (No Tool Calls): Just display the assistant's text response
-                assistant_response = response_message.content
-                if assistant_response:
-                    self.add_message_to_display("Agent", assistant_response)
-                else:
-                    # Handle cases where the model might return no text content (e.g., only tool calls were expected but none happened)
-                    self.add_message_to_display("System", "[Model returned no text content]", tag="System")
 
+                         # Display the tool result
+                         # Limit display length for very long results (like file content)
+                         display_response = function_response
+                         max_display_len = 500
+                         if len(display_response) > max_display_len:
+                            display_response = display_response[:max_display_len] + " [... result truncated ...]"
+                         self.add_message_to_display("ToolResult", f"Result: {display_response}", tag="ToolResult")
+
+                         # Append the tool result message for the next API call
+                         tool_messages_for_next_call.append({
+                             "tool_call_id": tool_call_id,
+                             "role": "tool",
+                             "name": function_name,
+                             "content": function_response, # Send the *full* response back to the model
+                         })
+
+                     # Step 4: Append all tool results to history
+                     for tool_message in tool_messages_for_next_call:
+                         self._append_history(tool_message)
+
+                     # Step 5: Call the API *again* with the tool results
+                     continue # Let the model process the tool results
 
-                # Re-enable input after processing is complete
-                self.input_entry.config(state='normal')
-                self.send_button.config(state='normal')
-                self.input_entry.focus() # Put cursor back in input
+                else:
+                    # Step 2 (No Tool Calls): The assistant's text response was already streamed
+                    if not response_message["content"]:
+                        # Handle cases where the model might return no text content (e.g., only tool calls were expected but none happened)
+                        self.add_message_to_display("System", "[Model returned no text content]", tag="System")
 
+                    # Done; input is re-enabled once in the finally block below
+                    break
 
         except (APIError, RateLimitError) as e:
             error_message = f"OpenAI API Error: {e}"
             self.add_message_to_display("Error", error_message, tag="Error")
             messagebox.showerror("API Error", error_message)
-             # Re-enable input on API error
-            self.input_entry.config(state='normal')
-            self.send_button.config(state='normal')
         except Exception as e:
             error_message = f"An unexpected error occurred: {str(e)}"
             self.add_message_to_display("Error", error_message, tag="Error")
             messagebox.showerror("Error", error_message)
-             # Re-enable input on general error
+        finally:
+            # Re-enable input after processing is complete (or failed)
             self.input_entry.config(state='normal')
             self.send_button.config(state='normal')
+            self.input_entry.focus() # Put cursor back in input
 
 
 # --- Main Execution ---